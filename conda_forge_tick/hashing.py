@@ -6,6 +6,9 @@ import functools
 
 import requests
 
+# bytes read from the response per hash update
+CHUNK_SIZE = 65536
+
 
 def _hash_url(url, hash_type, progress=False, conn=None, timeout=None):
     _hash = None
@@ -23,19 +26,19 @@ def _hash_url(url, hash_type, progress=False, conn=None, timeout=None):
 
         if resp.status_code == 200 and not timedout:
             if "Content-length" in resp.headers:
-                num = math.ceil(float(resp.headers["Content-length"]) / 8192)
+                num = math.ceil(float(resp.headers["Content-length"]) / CHUNK_SIZE)
             elif resp.url != url:
                 # redirect for download
                 h = requests.head(resp.url).headers
                 if "Content-length" in h:
-                    num = math.ceil(float(h["Content-length"]) / 8192)
+                    num = math.ceil(float(h["Content-length"]) / CHUNK_SIZE)
                 else:
                     num = None
             else:
                 num = None
 
             loc = 0
-            for itr, chunk in enumerate(resp.iter_content(chunk_size=8192)):
+            for itr, chunk in enumerate(resp.iter_content(chunk_size=CHUNK_SIZE)):
                 ha.update(chunk)
                 if num is not None and int((itr + 1) / num * 25) > loc and progress:
                     eta = (time.time() - t0) / (itr + 1) * (num - (itr + 1))
@@ -7,6 +7,7 @@ import collections.abc
 import hashlib
 import pprint
 import functools
+import itertools
 import random
 import traceback
 from typing import (
@@ -17,6 +18,7 @@ from typing import (
 )
 import warnings
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 import networkx as nx
 import conda.exceptions
@@ -45,11 +47,34 @@ CHECKSUM_NAMES = [
     "checksum",
 ]
 
+# number of transformed URLs that are downloaded and hashed at once
+# all probes share one pool, so this bounds the total number of concurrent
+# hash_url downloads in the process, including leftover probes from earlier
+# calls that are still running
+NUM_URL_PROBE_THREADS = 4
+
 # matches valid jinja2 vars
 JINJA2_VAR_RE = re.compile("{{ ((?:[a-zA-Z]|(?:_[a-zA-Z0-9]))[a-zA-Z0-9_]*) }}")
 
 logger = logging.getLogger("conda_forge_tick.migrators.version")
 
+_URL_PROBE_POOL = ThreadPoolExecutor(max_workers=NUM_URL_PROBE_THREADS)
+
+
+@functools.lru_cache(maxsize=4096)
+def _get_jinja2_vars(tmpl: str):
+    return frozenset(JINJA2_VAR_RE.findall(tmpl))
+
+
+class _LazyPformat:
+    """Pretty-print an object for logging only if the record is emitted."""
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        return pprint.pformat(self.obj)
+
 
 def _gen_key_selector(dct: MutableMapping, key: str):
     for k in dct:
@@ -58,67 +83,56 @@ def _gen_key_selector(dct: MutableMapping, key: str):
 
 
 def _recipe_has_git_url(cmeta):
-    found_git_url = False
     for src_key in _gen_key_selector(cmeta.meta, "source"):
         if isinstance(cmeta.meta[src_key], collections.abc.MutableSequence):
             for src in cmeta.meta[src_key]:
-                for git_url_key in _gen_key_selector(src, "git_url"):
-                    found_git_url = True
-                    break
-        else:
-            for git_url_key in _gen_key_selector(cmeta.meta[src_key], "git_url"):
-                found_git_url = True
-                break
+                if any(_gen_key_selector(src, "git_url")):
+                    return True
+        elif any(_gen_key_selector(cmeta.meta[src_key], "git_url")):
+            return True
 
-    return found_git_url
+    return False
 
 
 def _recipe_has_url(cmeta):
-    found_url = False
     for src_key in _gen_key_selector(cmeta.meta, "source"):
         if isinstance(cmeta.meta[src_key], collections.abc.MutableSequence):
             for src in cmeta.meta[src_key]:
-                for url_key in _gen_key_selector(src, "url"):
-                    found_url = True
-                    break
-        else:
-            for url_key in _gen_key_selector(cmeta.meta[src_key], "url"):
-                found_url = True
-                break
+                if any(_gen_key_selector(src, "url")):
+                    return True
+        elif any(_gen_key_selector(cmeta.meta[src_key], "url")):
+            return True
 
-    return found_url
+    return False
 
 
 def _is_r_url(url: str):
-    if "cran.r-project.org/src/contrib" in url or "cran_mirror" in url:
-        return True
-    else:
-        return False
+    return "cran.r-project.org/src/contrib" in url or "cran_mirror" in url
 
 
 def _has_r_url(curr_val: Any):
-    has_it = False
-    if isinstance(curr_val, collections.abc.MutableSequence):
-        for i in range(len(curr_val)):
-            has_it = has_it or _has_r_url(curr_val[i])
-    elif isinstance(curr_val, collections.abc.MutableMapping):
-        for key in _gen_key_selector(curr_val, "url"):
-            has_it = has_it or _has_r_url(curr_val[key])
-    elif isinstance(curr_val, str):
-        has_it = has_it or _is_r_url(curr_val)
+    # the parsed recipe is made of list/dict subclasses (ruamel's
+    # CommentedSeq/CommentedMap), so we check the concrete types instead of
+    # going through the slower abc isinstance machinery
+    stack = [curr_val]
+    while stack:
+        val = stack.pop()
+        if isinstance(val, list):
+            stack.extend(val)
+        elif isinstance(val, dict):
+            stack.extend(val[key] for key in _gen_key_selector(val, "url"))
+        elif isinstance(val, str) and _is_r_url(val):
+            return True
 
-    return has_it
+    return False
 
 
 def _compile_all_selectors(cmeta: Any, src: str):
-    selectors = [None]
-    for key in cmeta.jinja2_vars:
-        if CONDA_SELECTOR in key:
-            selectors.append(key.split(CONDA_SELECTOR)[1])
-    for key in src:
-        if CONDA_SELECTOR in key:
-            selectors.append(key.split(CONDA_SELECTOR)[1])
-    return set(selectors)
+    return {None} | {
+        key.split(CONDA_SELECTOR)[1]
+        for key in itertools.chain(cmeta.jinja2_vars, src)
+        if CONDA_SELECTOR in key
+    }
 
 
 def _try_url_and_hash_it(url: str, hash_type: str):
@@ -138,8 +152,34 @@ def _try_url_and_hash_it(url: str, hash_type: str):
         return None
 
 
+_JINJA2_ENV = jinja2.Environment(undefined=jinja2.StrictUndefined)
+
+
+@functools.lru_cache(maxsize=2048)
+def _compile_jinja2(tmpl):
+    return _JINJA2_ENV.from_string(tmpl)
+
+
 def _render_jinja2(tmpl, context):
-    return jinja2.Template(tmpl, undefined=jinja2.StrictUndefined).render(**context)
+    # most URL templates only substitute plain variables, so we skip
+    # jinja2 for those and fall back to it for anything else (jinja2 also
+    # normalizes newlines and strips a single trailing one, so templates
+    # with carriage returns or a trailing newline go to it too)
+    if (
+        "{%" not in tmpl
+        and "{#" not in tmpl
+        and "\r" not in tmpl
+        and not tmpl.endswith("\n")
+    ):
+        try:
+            rendered = JINJA2_VAR_RE.sub(lambda m: str(context[m.group(1)]), tmpl)
+        except KeyError:
+            pass
+        else:
+            if "{{" not in rendered:
+                return rendered
+
+    return _compile_jinja2(tmpl).render(**context)
 
 
 def _get_new_url_tmpl_and_hash(url_tmpl: str, context: MutableMapping, hash_type: str):
@@ -147,37 +187,57 @@ def _get_new_url_tmpl_and_hash(url_tmpl: str, context: MutableMapping, hash_type
         "hashing URL template: %s",
         url_tmpl,
     )
-    try:
-        logger.info(
-            "rendered URL: %s",
-            _render_jinja2(url_tmpl, context),
-        )
-    except jinja2.UndefinedError:
-        logger.info("initial URL template does not render")
-        pass
-
+    seen_urls = set()
     try:
         url = _render_jinja2(url_tmpl, context)
-        new_hash = _try_url_and_hash_it(url, hash_type)
+        logger.info("rendered URL: %s", url)
+        new_hash = _URL_PROBE_POOL.submit(
+            _try_url_and_hash_it,
+            url,
+            hash_type,
+        ).result()
         if new_hash is not None:
             return url_tmpl, new_hash
+        seen_urls.add(url)
     except jinja2.UndefinedError:
-        pass
+        logger.info("initial URL template does not render")
 
-    new_url_tmpl = None
-    new_hash = None
+    # different transforms can give the same template or render to the same
+    # url, so we only probe each url once and skip the one we just tried
+    candidates = []
+    for new_url_tmpl in dict.fromkeys(gen_transformed_urls(url_tmpl)):
+        if new_url_tmpl == url_tmpl:
+            continue
 
-    for new_url_tmpl in gen_transformed_urls(url_tmpl):
         try:
             url = _render_jinja2(new_url_tmpl, context)
-            new_hash = _try_url_and_hash_it(url, hash_type)
         except jinja2.UndefinedError:
-            new_hash = None
+            continue
 
+        if url not in seen_urls:
+            seen_urls.add(url)
+            candidates.append((new_url_tmpl, url))
+
+    if not candidates:
+        return None, None
+
+    # probe the candidates concurrently but keep the first one that hashes
+    # in the order they were generated
+    futures = [
+        _URL_PROBE_POOL.submit(_try_url_and_hash_it, url, hash_type)
+        for _, url in candidates
+    ]
+    for (new_url_tmpl, _), fut in zip(candidates, futures):
+        new_hash = fut.result()
         if new_hash is not None:
-            break
+            # probes that have not started are cancelled, while the ones
+            # already running finish in the background (or hit the hash_url
+            # timeout) and hold their slots in the shared pool until then
+            for _fut in futures:
+                _fut.cancel()
+            return new_url_tmpl, new_hash
 
-    return new_url_tmpl, new_hash
+    return None, None
 
 
 def _try_replace_hash(
@@ -192,9 +252,7 @@ def _try_replace_hash(
     if "{{" in src[hash_key] and "}}" in src[hash_key]:
         # it's jinja2 :(
         cnames = set(
-            CHECKSUM_NAMES
-            + [hash_type]
-            + list(set(JINJA2_VAR_RE.findall(src[hash_key]))),
+            CHECKSUM_NAMES + [hash_type] + list(_get_jinja2_vars(src[hash_key])),
         )
         for cname in cnames:
             if selector is not None:
@@ -203,21 +261,21 @@ def _try_replace_hash(
                     cmeta.jinja2_vars[key] = new_hash
                     logger.info(
                         "jinja2 w/ new hash: %s",
-                        pprint.pformat(cmeta.jinja2_vars),
+                        _LazyPformat(cmeta.jinja2_vars),
                     )
                     _replaced_hash = True
                     break
 
             if cname in cmeta.jinja2_vars:
                 cmeta.jinja2_vars[cname] = new_hash
-                logger.info("jinja2 w/ new hash: %s", pprint.pformat(cmeta.jinja2_vars))
+                logger.info("jinja2 w/ new hash: %s", _LazyPformat(cmeta.jinja2_vars))
                 _replaced_hash = True
                 break
 
     else:
         _replaced_hash = True
         src[hash_key] = new_hash
-        logger.info("source w/ new hash: %s", pprint.pformat(src))
+        logger.info("source w/ new hash: %s", _LazyPformat(src))
 
     return _replaced_hash
 
@@ -232,8 +290,7 @@ def _try_to_update_version(cmeta: Any, src: str, hash_type: str):
         errors.add("no URLs in the source section")
         return False, errors
 
-    ha = getattr(hashlib, hash_type, None)
-    if ha is None:
+    if hash_type not in hashlib.algorithms_guaranteed:
         errors.add("invalid hash type %s" % hash_type)
         return False, errors
 
@@ -242,6 +299,13 @@ def _try_to_update_version(cmeta: Any, src: str, hash_type: str):
     # first we compile all selectors
     possible_selectors = _compile_all_selectors(cmeta, src)
 
+    # index the source keys and jinja2 vars by their names w/o selectors
+    src_keys = collections.defaultdict(list)
+    for key in src:
+        src_keys[key.split(CONDA_SELECTOR)[0]].append(key)
+    jinja2_var_keys = [(key, key.split(CONDA_SELECTOR)[0]) for key in cmeta.jinja2_vars]
+    jinja2_var_names = {name for _, name in jinja2_var_keys}
+
     # now loop through them and try to construct sets of
     # 1. urls
     # 2. hashes
@@ -253,7 +317,7 @@ def _try_to_update_version(cmeta: Any, src: str, hash_type: str):
         logger.info("selector: %s", selector)
         url_key = "url"
         if selector is not None:
-            for key in _gen_key_selector(src, "url"):
+            for key in src_keys["url"]:
                 if selector in key:
                     url_key = key
 
@@ -264,7 +328,7 @@ def _try_to_update_version(cmeta: Any, src: str, hash_type: str):
         hash_key = None
         for _hash_type in {"md5", "sha256", hash_type}:
             if selector is not None:
-                for key in _gen_key_selector(src, _hash_type):
+                for key in src_keys[_hash_type]:
                     if selector in key:
                         hash_key = key
                         hash_type = _hash_type
@@ -283,20 +347,22 @@ def _try_to_update_version(cmeta: Any, src: str, hash_type: str):
             continue
 
         # jinja2 stuff
+        # the values are read each time since hashes found for earlier
+        # selectors may have been put back into the jinja2 vars
         context = {}
-        for key, val in cmeta.jinja2_vars.items():
-            if CONDA_SELECTOR in key:
+        for key, name in jinja2_var_keys:
+            if key != name:
                 if selector is not None and selector in key:
-                    context[key.split(CONDA_SELECTOR)[0]] = val
+                    context[name] = cmeta.jinja2_vars[key]
             else:
-                context[key] = val
+                context[key] = cmeta.jinja2_vars[key]
         # this pulls out any jinja2 expressions that are not constans
         # e.g. bits of jinja2 that extract version parts
         evaled_context = cmeta.eval_jinja2_exprs(context)
-        logger.info("jinja2 context: %s", pprint.pformat(context))
-        logger.info("evaluated jinja2 vars: %s", pprint.pformat(evaled_context))
+        logger.info("jinja2 context: %s", _LazyPformat(context))
+        logger.info("evaluated jinja2 vars: %s", _LazyPformat(evaled_context))
         context.update(evaled_context)
-        logger.info("updated jinja2 context: %s", pprint.pformat(context))
+        logger.info("updated jinja2 context: %s", _LazyPformat(context))
 
         # get all of the possible variables in the url
         # if we do not have them or any selector versions, then
@@ -304,18 +370,17 @@ def _try_to_update_version(cmeta: Any, src: str, hash_type: str):
         jinja2_var_set = set()
         if isinstance(src[url_key], collections.abc.MutableSequence):
             for url_tmpl in src[url_key]:
-                jinja2_var_set |= set(JINJA2_VAR_RE.findall(url_tmpl))
+                jinja2_var_set |= _get_jinja2_vars(url_tmpl)
         else:
-            jinja2_var_set |= set(JINJA2_VAR_RE.findall(src[url_key]))
+            jinja2_var_set |= _get_jinja2_vars(src[url_key])
 
-        jinja2_var_set |= set(JINJA2_VAR_RE.findall(src[hash_key]))
+        jinja2_var_set |= _get_jinja2_vars(src[hash_key])
 
         skip_this_selector = False
         for var in jinja2_var_set:
-            possible_keys = list(_gen_key_selector(cmeta.jinja2_vars, var)) + list(
+            if var not in jinja2_var_names and not any(
                 _gen_key_selector(evaled_context, var),
-            )
-            if len(possible_keys) == 0:
+            ):
                 if var == "cran_mirror":
                     context["cran_mirror"] = "https://cran.r-project.org"
                 else:
@@ -372,11 +437,11 @@ def _try_to_update_version(cmeta: Any, src: str, hash_type: str):
             if _replaced_hash:
                 if isinstance(src[url_key], collections.abc.MutableSequence):
                     src[url_key][url_ind] = new_url_tmpl
-                    logger.info("source w/ new url: %s", pprint.pformat(src[url_key]))
+                    logger.info("source w/ new url: %s", _LazyPformat(src[url_key]))
 
                 else:
                     src[url_key] = new_url_tmpl
-                    logger.info("source w/ new url: %s", pprint.pformat(src))
+                    logger.info("source w/ new url: %s", _LazyPformat(src))
             else:
                 new_hash = None
                 errors.add(
@@ -394,6 +459,14 @@ def _try_to_update_version(cmeta: Any, src: str, hash_type: str):
     return updated_version, errors
 
 
+def _recipe_signature(cmeta):
+    # cheaper than dumping the recipe to yaml just to see if it changed
+    return hashlib.blake2b(
+        (repr(cmeta.meta) + repr(cmeta.jinja2_vars)).encode("utf-8"),
+        digest_size=16,
+    ).digest()
+
+
 def _fmt_error_message(errors, version):
     msg = (
         "The recipe did not change in the version migration, a URL did "
@@ -450,16 +523,13 @@ class Version(Migrator):
         )
 
         try:
+            new_version = VersionOrder(str(attrs["new_version"]))
             version_filter = (
                 # if new version is less than current version
-                (
-                    VersionOrder(str(attrs["new_version"]))
-                    <= VersionOrder(str(attrs.get("version", "0.0.0")))
-                )
+                new_version <= VersionOrder(str(attrs.get("version", "0.0.0")))
                 # if PRed version is greater than newest version
                 or any(
-                    VersionOrder(self._extract_version_from_muid(h))
-                    >= VersionOrder(str(attrs["new_version"]))
+                    VersionOrder(self._extract_version_from_muid(h)) >= new_version
                     for h in attrs.get("PRed", set())
                 )
             )
@@ -526,11 +596,8 @@ class Version(Migrator):
             )
             return {}
 
-        # cache round-tripped yaml for testing later
-        s = io.StringIO()
-        cmeta.dump(s)
-        s.seek(0)
-        old_meta_yaml = s.read()
+        # cache a signature of the recipe for testing later
+        old_recipe_sig = _recipe_signature(cmeta)
 
         # if is a git url, then we error
         if _recipe_has_git_url(cmeta) and not _recipe_has_url(cmeta):
@@ -540,12 +607,13 @@ class Version(Migrator):
             return {}
 
         # mangle the version if it is R
-        r_url = False
-        for src_key in _gen_key_selector(cmeta.meta, "source"):
-            r_url |= _has_r_url(cmeta.meta[src_key])
-        for key, val in cmeta.jinja2_vars.items():
-            if isinstance(val, str):
-                r_url |= _is_r_url(val)
+        r_url = any(
+            _has_r_url(cmeta.meta[src_key])
+            for src_key in _gen_key_selector(cmeta.meta, "source")
+        ) or any(
+            isinstance(val, str) and _is_r_url(val)
+            for val in cmeta.jinja2_vars.values()
+        )
         if r_url:
             version = version.replace("_", "-")
 
@@ -594,10 +662,7 @@ class Version(Migrator):
         if did_update:
             # if the yaml did not change, then we did not migrate actually
             cmeta.jinja2_vars["version"] = old_version
-            s = io.StringIO()
-            cmeta.dump(s)
-            s.seek(0)
-            still_the_same = s.read() == old_meta_yaml
+            still_the_same = _recipe_signature(cmeta) == old_recipe_sig
             cmeta.jinja2_vars["version"] = version  # put back version
 
             if still_the_same and old_version != version:
@@ -867,11 +932,9 @@ class Version(Migrator):
 
         random.seed()
         nodes_to_sort = list(graph.nodes)
+        random.shuffle(nodes_to_sort)
         return sorted(
-            sorted(
-                sorted(nodes_to_sort, key=lambda x: random.uniform(0, 1)),
-                key=_get_attemps,
-            ),
+            sorted(nodes_to_sort, key=_get_attemps),
             key=functools.cmp_to_key(_desc_cmp),
         )
 
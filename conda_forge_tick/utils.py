@@ -436,7 +436,9 @@ def pluck(G: nx.DiGraph, node_id: Any) -> None:
 def executor(kind: str, max_workers: int, daemon=True) -> typing.Iterator[Executor]:
     """General purpose utility to get an executor with its as_completed handler
 
-    This allows us to easily use other executors as needed.
+    This allows us to easily use other executors as needed. Use "dask-thread"
+    for I/O bound work (e.g., HTTP requests to GitHub) since it runs a single
+    in-process dask worker with a thread pool and avoids per-task serialization.
     """
     if kind == "thread":
         with ThreadPoolExecutor(max_workers=max_workers) as pool_t:
@@ -449,13 +451,17 @@ def executor(kind: str, max_workers: int, daemon=True) -> typing.Iterator[Execut
         import distributed
         from distributed.cfexecutor import ClientExecutor
 
-        processes = kind == "dask" or kind == "dask-process"
+        if kind == "dask-thread":
+            cluster_kwargs = dict(
+                n_workers=1,
+                threads_per_worker=max_workers,
+                processes=False,
+            )
+        else:
+            cluster_kwargs = dict(n_workers=max_workers, processes=True)
 
         with dask.config.set({"distributed.worker.daemon": daemon}):
-            with distributed.LocalCluster(
-                n_workers=max_workers,
-                processes=processes,
-            ) as cluster:
+            with distributed.LocalCluster(**cluster_kwargs) as cluster:
                 with distributed.Client(cluster) as client:
                     yield ClientExecutor(client)
     else:
@@ -1,9 +1,16 @@
 import os
+import time
 import logging
+import collections
+import jinja2
 import pytest
 from flaky import flaky
 
 from conda_forge_tick.migrators import Version
+from conda_forge_tick.migrators.version import (
+    _render_jinja2,
+    _get_new_url_tmpl_and_hash,
+)
 
 from test_migrators import run_test_migration
 
@@ -143,3 +150,96 @@ def test_version_cupy(tmpdir, caplog):
         },
         tmpdir=tmpdir,
     )
+
+
+@pytest.mark.parametrize(
+    "tmpl",
+    [
+        "https://foo.org/{{ name }}/{{ name }}-{{ version }}.tar.gz",
+        "https://foo.org/{{ name }}-{{ number }}.tar.gz",
+        "https://foo.org/{{ name[0] }}/{{ name }}-{{ version }}.tar.gz",
+        "https://foo.org/{{version}}.tar.gz",
+        "https://foo.org/{{ version.replace('.', '_') }}.tar.gz",
+        "https://foo.org/{{ name|upper }}-{{ version }}.tar.gz",
+        "https://foo.org/{{ missing|default('blah') }}.tar.gz",
+        "{% if true %}https://foo.org/{{ version }}.tar.gz{% endif %}",
+        "https://foo.org/{# comment #}{{ version }}.tar.gz",
+        "https://foo.org/{{ version }}.tar.gz\n",
+        "a\r\nb{{ version }}",
+    ],
+)
+def test_version_render_jinja2(tmpl):
+    context = {"name": "foo", "version": "1.2.3", "number": 5}
+    correct = jinja2.Template(tmpl, undefined=jinja2.StrictUndefined).render(
+        **context,
+    )
+    assert _render_jinja2(tmpl, context) == correct
+
+
+@pytest.mark.parametrize(
+    "tmpl",
+    [
+        "https://foo.org/{{ missing }}.tar.gz",
+        "https://foo.org/{{ name }}/{{ missing[0] }}.tar.gz",
+    ],
+)
+def test_version_render_jinja2_undefined(tmpl):
+    with pytest.raises(jinja2.UndefinedError):
+        _render_jinja2(tmpl, {"name": "foo"})
+
+
+URL_TMPL = "https://foo.org/{{version}}/foo-{{ version }}.tar.gz"
+
+
+def _fake_hash_url(calls, hashes, delays=None):
+    delays = delays or {}
+
+    def _hash_url(url, timeout=None, hash_type="sha256"):
+        calls.append(url)
+        time.sleep(delays.get(url, 0))
+        return hashes.get(url)
+
+    return _hash_url
+
+
+def test_version_url_probe_in_order(monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        "conda_forge_tick.migrators.version.hash_url",
+        _fake_hash_url(
+            calls,
+            {
+                "https://foo.org/1.0/foo-1.0.tar": "slow",
+                "https://foo.org/1.0/foo-1.0.tar.bz2": "fast",
+            },
+            delays={"https://foo.org/1.0/foo-1.0.tar": 0.5},
+        ),
+    )
+
+    assert _get_new_url_tmpl_and_hash(URL_TMPL, {"version": "1.0"}, "sha256") == (
+        "https://foo.org/{{version}}/foo-{{ version }}.tar",
+        "slow",
+    )
+    assert "https://foo.org/1.0/foo-1.0.tar.bz2" in calls
+
+
+def test_version_url_probe_dedupe(monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        "conda_forge_tick.migrators.version.hash_url",
+        _fake_hash_url(calls, {}),
+    )
+
+    assert _get_new_url_tmpl_and_hash(URL_TMPL, {"version": "1.0"}, "sha256") == (
+        None,
+        None,
+    )
+    # '{{version}}' and '{{ version }}' render the same, so each url,
+    # including the original one, is only downloaded once
+    assert calls[0] == "https://foo.org/1.0/foo-1.0.tar.gz"
+    assert collections.Counter(calls).most_common(1)[0][1] == 1
+    assert set(calls) == {
+        "https://foo.org/%s/foo-%s%s" % (d, f, ext)
+        for d, f in [("1.0", "1.0"), ("1.0", "v1.0"), ("v1.0", "v1.0")]
+        for ext in [".tar.gz", ".zip", ".tar", ".tar.bz2", ".tar.xz", ".tgz"]
+    }